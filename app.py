@@ -1,17 +1,52 @@
+import functools
 import gc
+import hashlib
 import io
+import logging
+import os
+import struct
 import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from typing import List, Tuple
 
+import numpy as np
 import streamlit as st
-from PIL import Image, ImageOps, ImageCms, ImageEnhance
+from PIL import ExifTags, Image, ImageOps, ImageCms
+
+logger = logging.getLogger(__name__)
+
+# Optional: libjpeg-turbo's TurboJPEG API for SIMD JPEG encoding. Needs PyTurboJPEG
+# 1.x, which works with the libturbojpeg 2.x that distros ship (2.x needs libjpeg-turbo 3).
+try:
+    from turbojpeg import TurboJPEG, TJFLAG_PROGRESSIVE, TJPF_RGB, TJSAMP_420
+except ImportError:
+    TurboJPEG = None
+
+
+@st.cache_resource(show_spinner=False)
+def load_turbojpeg():
+    """TurboJPEG handle, or None to encode with Pillow. Cached for the process,
+    so the fallback is only logged once rather than on every rerun."""
+    if TurboJPEG is None:
+        logger.warning("PyTurboJPEG is not installed, encoding JPEG with Pillow")
+        return None
+    try:
+        return TurboJPEG()
+    except Exception as exc:
+        logger.warning("TurboJPEG unavailable (%s), encoding JPEG with Pillow", exc)
+        return None
+
+
+_turbo = load_turbojpeg()
 
 # -------------------------------
 # Helpers
 # -------------------------------
 
 def read_uploaded_images(uploaded_files):
+    """Collect (name, encoded bytes, content digest) for each upload; decoding is
+    deferred to open_image."""
     images = []
     if not uploaded_files:
         return images
@@ -20,41 +55,118 @@ def read_uploaded_images(uploaded_files):
         name = getattr(uf, "name", "upload")
         try:
             if name.lower().endswith(".zip"):
-                raw = uf.read()
-                uf.close()  # release any temp file
-                with zipfile.ZipFile(io.BytesIO(raw)) as zf:
+                # The upload is seekable, so ZipFile reads entries straight from it
+                # instead of from a second full copy of the archive
+                with uf, zipfile.ZipFile(uf) as zf:
                     for info in zf.infolist():
                         if info.is_dir():
                             continue
                         lower = info.filename.lower()
                         if not lower.endswith((".jpg", ".jpeg", ".png", ".webp", ".tif", ".tiff")):
                             continue
-                        with zf.open(info) as f:
-                            data = f.read()
-                        im = Image.open(io.BytesIO(data))
-                        im = ImageOps.exif_transpose(im)
-                        images.append((info.filename, im))
+                        data = zf.read(info)
+                        Image.open(io.BytesIO(data))  # header check only, skips non-images
+                        images.append((info.filename, data, content_digest(data)))
             else:
                 data = uf.read()
                 uf.close()
-                im = Image.open(io.BytesIO(data))
-                im = ImageOps.exif_transpose(im)
-                images.append((name, im))
+                Image.open(io.BytesIO(data))
+                images.append((name, data, content_digest(data)))
         except Exception:
             continue
     return images
 
 
+def content_digest(data: bytes) -> bytes:
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def open_image(data: bytes, target_long: int = 0, transpose: bool = True) -> Image.Image:
+    """Decode an uploaded image. For JPEGs, libjpeg's scaled IDCT decodes straight
+    to the smallest 1/2, 1/4 or 1/8 size that still covers target_long.
+    With transpose=False the EXIF orientation is left for the caller to apply."""
+    im = Image.open(io.BytesIO(data))
+    if im.format == "JPEG" and target_long > 0:
+        im.draft(im.mode, (target_long, target_long))
+    im.load()
+    return ImageOps.exif_transpose(im) if transpose else im
+
+
+_ORIENTATION_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+
+def apply_orientation(img: Image.Image, orientation: int) -> Image.Image:
+    """Apply an EXIF orientation value, clearing the tag so viewers don't rotate twice."""
+    method = _ORIENTATION_TRANSPOSE.get(orientation)
+    if method is None:
+        return img
+    out = img.transpose(method)
+    if "exif" in out.info:
+        exif = out.getexif()
+        exif.pop(ExifTags.Base.Orientation, None)
+        out.info["exif"] = exif.tobytes()
+    return out
+
+
+def open_watermark(wm_bytes: bytes | None) -> Image.Image | None:
+    if not wm_bytes:
+        return None
+    return Image.open(io.BytesIO(wm_bytes)).convert("RGBA")
+
+
+def icc_profile_id(icc_profile: bytes) -> str:
+    """ICC profile ID: MD5 of the profile with the flags, rendering intent and
+    profile ID header fields zeroed (ICC.1, 7.2.18). Computed rather than read,
+    since v2 profiles usually leave the stored ID empty."""
+    data = bytearray(icc_profile)
+    data[44:48] = bytes(4)
+    data[64:68] = bytes(4)
+    data[84:100] = bytes(16)
+    return hashlib.md5(data).hexdigest()
+
+
+_SRGB_PROFILE = ImageCms.ImageCmsProfile(ImageCms.createProfile("sRGB"))
+
+# Exact sRGB profiles that need no transform. Anything else, including profiles
+# that merely mention sRGB in their name, goes through lcms2.
+_SRGB_PROFILE_IDS = {
+    "1d3fda2edb4a89ab60a23c5f7c7d81dd",  # sRGB IEC61966-2.1 (HP/Microsoft, 3144 bytes)
+    "61473528d5aaa311e143dfc93efaa268",  # sRGB IEC61966-2.1 (compact, 596 bytes)
+    "3d0eb2deae9397be9b6726ce8c0a43ce",  # sRGB2014 (ICC)
+    icc_profile_id(_SRGB_PROFILE.tobytes()),  # lcms2 built-in
+}
+
+
+@functools.lru_cache(maxsize=16)
+def srgb_transform(icc_profile: bytes, mode: str) -> ImageCms.ImageCmsTransform | None:
+    """Build the lcms2 transform to sRGB once per distinct embedded profile.
+    Returns None if the profile is a known sRGB profile."""
+    if icc_profile_id(icc_profile) in _SRGB_PROFILE_IDS:
+        return None
+    src_profile = ImageCms.ImageCmsProfile(io.BytesIO(icc_profile))
+    return ImageCms.buildTransformFromOpenProfiles(src_profile, _SRGB_PROFILE, mode, "RGB")
+
 
 def ensure_rgb_and_srgb(img: Image.Image, convert_to_srgb: bool = True) -> Image.Image:
     # Always output RGB to avoid surprises when saving JPEG/WebP
+    if img.mode == "RGB" and "icc_profile" not in img.info:
+        return img  # nothing to do, and convert() would copy the whole frame
     if convert_to_srgb:
         try:
+            transform = None
             if "icc_profile" in img.info:
-                src_profile = ImageCms.ImageCmsProfile(io.BytesIO(img.info.get("icc_profile")))
-                dst_profile = ImageCms.createProfile("sRGB")
-                img = ImageCms.profileToProfile(img, src_profile, dst_profile, outputMode="RGB")
-            else:
+                transform = srgb_transform(img.info["icc_profile"], img.mode)
+            if transform is not None:
+                img = ImageCms.applyTransform(img, transform)
+            elif img.mode != "RGB":
                 img = img.convert("RGB")
         except Exception:
             img = img.convert("RGB")
@@ -72,36 +184,42 @@ def resize_to_long_edge(img: Image.Image, target_long: int) -> Image.Image:
     scale = target_long / float(long_side)
     new_w = int(round(w * scale))
     new_h = int(round(h * scale))
-    return img.resize((new_w, new_h), Image.LANCZOS)
-
+    # Large downscales first box-reduce by an integer factor to within 2x of the
+    # target, so Lanczos only runs over a small source
+    return img.resize((new_w, new_h), Image.LANCZOS, reducing_gap=2.0)
 
-def apply_watermark(base: Image.Image,
-                    watermark: Image.Image,
-                    position: str = "bottom-right",
-                    scale_pct: float = 10.0,
-                    opacity_pct: float = 70.0,
-                    margin_px: int = 24,
-                    recolor: str = "none") -> Image.Image:
-    if watermark is None:
-        return base
 
-    base = base.convert("RGBA")
-    wm = watermark.convert("RGBA")
+def prepare_watermark(watermark: Image.Image,
+                      base_width: int,
+                      scale_pct: float = 10.0,
+                      opacity_pct: float = 70.0,
+                      recolor: str = "none") -> Image.Image:
+    """Recolor, scale and fade the watermark for a base image of the given width.
+    The result only depends on these arguments, so batches can reuse it."""
+    # Callers sharing one watermark across threads convert it to RGBA up front
+    wm = watermark if watermark.mode == "RGBA" else watermark.convert("RGBA")
 
     # Optional recolor before scaling
     wm = recolor_watermark(wm, recolor)
 
     # Scale watermark based on base width
-    target_w = max(1, int(round(base.width * (scale_pct / 100.0))))
+    target_w = max(1, int(round(base_width * (scale_pct / 100.0))))
     scale = target_w / max(1, wm.width)
     wm = wm.resize((target_w, max(1, int(round(wm.height * scale)))), Image.LANCZOS)
 
     # Apply opacity
     if 0 <= opacity_pct < 100:
-        alpha = wm.split()[-1]
-        alpha = ImageEnhance.Brightness(alpha).enhance(opacity_pct / 100.0)
-        wm.putalpha(alpha)
+        alpha = np.asarray(wm.getchannel("A"), dtype=np.uint16)
+        alpha = alpha * int(round(opacity_pct * 255 / 100.0)) // 255
+        wm.putalpha(Image.fromarray(alpha.astype(np.uint8)))
+    return wm
+
 
+def paste_watermark(base: Image.Image,
+                    wm: Image.Image,
+                    position: str = "bottom-right",
+                    margin_px: int = 24) -> Image.Image:
+    """Composite a watermark from prepare_watermark onto base. wm is only read."""
     # Compute raw position
     positions = {
         "top-left": (margin_px, margin_px),
@@ -118,25 +236,48 @@ def apply_watermark(base: Image.Image,
     x = min(max(int(round(x)), 0), max_x)
     y = min(max(int(round(y)), 0), max_y)
 
-    out = base.copy()
+    if base.mode == "RGB":
+        # Opaque base: a masked paste blends the same way as alpha_composite,
+        # without promoting the whole image to RGBA and back
+        out = base.copy()
+        out.paste(wm, (x, y), mask=wm)
+        return out
+
+    out = base.convert("RGBA")
     out.alpha_composite(wm, dest=(x, y))
     return out.convert("RGB")
 
 
+# JPEGs smaller than this are always written as baseline
+PROGRESSIVE_MIN_PIXELS = 800 * 800
+
 def save_image_bytes(img: Image.Image,
                      fmt: str = "JPEG",
                      quality: int = 85,
                      progressive: bool = True,
                      optimize: bool = True,
-                     keep_metadata: bool = False) -> bytes:
-    """Encode an image to bytes, optionally keeping EXIF, without mutating the input."""
+                     keep_metadata: bool = False,
+                     fast: bool = False) -> bytes:
+    """Encode an image to bytes, optionally keeping EXIF, without mutating the input.
+    fast trades a little file size for encode speed, for interactive previews."""
     fmt = fmt.upper()
+    if fast:
+        progressive = optimize = False
     exif_bytes = img.info.get("exif", b"") if keep_metadata else b""
-    work = img.copy()  # don’t mutate the original
+    # save() never mutates, and convert() returns a new image, so no defensive copy
+    work = img
 
     buf = io.BytesIO()
     if fmt == "JPEG":
-        work = work.convert("RGB")
+        if work.mode != "RGB":
+            work = work.convert("RGB")
+        # Progressive costs an extra pass over the coefficients and saves little on small images
+        if work.width * work.height < PROGRESSIVE_MIN_PIXELS:
+            progressive = False
+        # The TurboJPEG API has no optimize flag (progressive output gets optimized
+        # Huffman tables anyway), so optimized baseline JPEG goes through Pillow
+        if _turbo is not None and (progressive or not optimize):
+            return encode_jpeg_turbo(work, quality, progressive, exif_bytes)
         work.save(
             buf,
             format="JPEG",
@@ -147,7 +288,7 @@ def save_image_bytes(img: Image.Image,
         )
     elif fmt == "WEBP":
         try:
-            work.save(buf, format="WEBP", quality=int(quality), method=6, exif=exif_bytes)
+            work.save(buf, format="WEBP", quality=int(quality), method=4 if fast else 6, exif=exif_bytes)
         except TypeError:
             work.save(buf, format="WEBP", quality=int(quality))
     else:
@@ -155,8 +296,36 @@ def save_image_bytes(img: Image.Image,
     return buf.getvalue()
 
 
+def encode_jpeg_turbo(img: Image.Image,
+                      quality: int = 85,
+                      progressive: bool = True,
+                      exif_bytes: bytes = b"") -> bytes:
+    """Encode an RGB image with TurboJPEG, re-inserting EXIF as an APP1 segment."""
+    out = _turbo.encode(
+        np.asarray(img),
+        quality=int(quality),
+        pixel_format=TJPF_RGB,
+        jpeg_subsample=TJSAMP_420,
+        flags=TJFLAG_PROGRESSIVE if progressive else 0,
+    )
+    if not exif_bytes:
+        return out
+
+    if not exif_bytes.startswith(b"Exif\x00\x00"):
+        exif_bytes = b"Exif\x00\x00" + exif_bytes
+    if len(exif_bytes) > 0xFFFF - 2:
+        raise ValueError("EXIF data is too long")
+    app1 = b"\xff\xe1" + struct.pack(">H", len(exif_bytes) + 2) + exif_bytes
+
+    # Keep the JFIF APP0 segment first, like Pillow does
+    pos = 2
+    if out[2:4] == b"\xff\xe0":
+        pos = 4 + struct.unpack(">H", out[4:6])[0]
+    return out[:pos] + app1 + out[pos:]
+
 
-def process_one(image: Image.Image,
+
+def process_one(data: bytes,
                 target_long: int,
                 out_fmt: str,
                 quality: int,
@@ -169,22 +338,179 @@ def process_one(image: Image.Image,
                 wm_scale_pct: float,
                 wm_opacity_pct: float,
                 wm_margin_px: int,
-                wm_recolor:str = "none") -> Image.Image:
-    img = ensure_rgb_and_srgb(image, convert_to_srgb)
+                wm_recolor:str = "none",
+                wm_cache: dict | None = None) -> Image.Image:
+    img = open_image(data, target_long, transpose=False)
+    # Read before colour conversion, which can drop img.info
+    orientation = img.getexif().get(ExifTags.Base.Orientation, 1)
+    img = ensure_rgb_and_srgb(img, convert_to_srgb)
     img = resize_to_long_edge(img, target_long)
+    # Rotate after resizing so only target-sized pixels are moved; before the
+    # watermark so its position refers to the upright image
+    img = apply_orientation(img, orientation)
     if wm_img is not None:
-        img = apply_watermark(img, wm_img, wm_position, wm_scale_pct, wm_opacity_pct, wm_margin_px, wm_recolor)
+        # Batches are usually one width after resizing, so the prepared watermark is shared
+        key = (img.width, wm_scale_pct, wm_opacity_pct, wm_recolor)
+        wm = wm_cache.get(key) if wm_cache is not None else None
+        if wm is None:
+            wm = prepare_watermark(wm_img, img.width, wm_scale_pct, wm_opacity_pct, wm_recolor)
+            if wm_cache is not None:
+                wm_cache[key] = wm
+        img = paste_watermark(img, wm, wm_position, wm_margin_px)
     # Nothing else here, saving happens separately to bytes for preview size
     return img
 
 
+# Sum of the IJG standard luminance quantization table (JPEG spec, Annex K)
+_STD_LUMA_QTABLE_SUM = 3688
+
+
+def estimate_jpeg_quality(im: Image.Image) -> int:
+    """Estimate the IJG quality a JPEG was saved at from its luminance table."""
+    scale = sum(im.quantization[0]) * 100.0 / _STD_LUMA_QTABLE_SUM
+    quality = (200 - scale) / 2 if scale <= 100 else 5000 / scale
+    return int(round(min(max(quality, 1), 100)))
+
+
+def strip_jpeg_metadata(data: bytes) -> bytes:
+    """Drop APP1-APP13, APP15 and COM segments (EXIF, ICC, XMP, comments) without
+    touching the compressed image data. JFIF APP0 and Adobe APP14 are kept
+    because they affect how the colour data is decoded."""
+    if data[:2] != b"\xff\xd8":
+        raise ValueError("not a JPEG")
+    out = [data[:2]]
+    pos = 2
+    while True:
+        if data[pos] != 0xFF:
+            raise ValueError("malformed JPEG marker")
+        marker = data[pos + 1]
+        if marker == 0xFF:  # fill byte
+            pos += 1
+            continue
+        if marker == 0xDA:  # start of scan, the rest is entropy-coded data
+            break
+        length = struct.unpack(">H", data[pos + 2:pos + 4])[0]
+        if not (0xE1 <= marker <= 0xED or marker in (0xEF, 0xFE)):
+            out.append(data[pos:pos + 2 + length])
+        pos += 2 + length
+    out.append(data[pos:])
+    return b"".join(out)
+
+
+def jpeg_passthrough(data: bytes,
+                     target_long: int,
+                     out_fmt: str,
+                     quality: int,
+                     progressive: bool,
+                     optimize: bool,
+                     convert_to_srgb: bool,
+                     keep_metadata: bool,
+                     wm_img: Image.Image | None) -> bytes | None:
+    """Return the uploaded JPEG itself when process_one would only decode and
+    re-encode it: no resize, rotation, watermark or colour conversion, it was
+    saved at no higher quality than requested, and it already has the requested
+    progressive/optimize encoding. None means run the pipeline."""
+    if out_fmt.upper() != "JPEG" or wm_img is not None:
+        return None
+    try:
+        im = Image.open(io.BytesIO(data))  # header only
+        if im.format != "JPEG" or im.mode != "RGB":
+            return None
+        if target_long > 0 and max(im.size) > target_long:
+            return None
+        if im.getexif().get(ExifTags.Base.Orientation, 1) != 1:
+            return None
+        if convert_to_srgb and "icc_profile" in im.info \
+                and srgb_transform(im.info["icc_profile"], im.mode) is not None:
+            return None
+        if estimate_jpeg_quality(im) > quality:
+            return None
+        # Match what save_image_bytes would write
+        src_progressive = bool(im.info.get("progressive"))
+        if src_progressive != (progressive and im.width * im.height >= PROGRESSIVE_MIN_PIXELS):
+            return None
+        # Optimized Huffman tables can't be confirmed from a baseline file's header;
+        # progressive files from libjpeg always carry them
+        if optimize and not src_progressive:
+            return None
+        return data if keep_metadata else strip_jpeg_metadata(data)
+    except Exception:
+        return None
+
+
+def render_output_bytes(data: bytes,
+                        target_long: int,
+                        out_fmt: str,
+                        quality: int,
+                        progressive: bool,
+                        optimize: bool,
+                        convert_to_srgb: bool,
+                        keep_metadata: bool,
+                        wm_img: Image.Image | None,
+                        wm_position: str,
+                        wm_scale_pct: float,
+                        wm_opacity_pct: float,
+                        wm_margin_px: int,
+                        wm_recolor: str = "none",
+                        fast: bool = False,
+                        wm_cache: dict | None = None) -> bytes:
+    """process_one + save_image_bytes. Safe to run from worker threads as long as
+    wm_img is already loaded (e.g. converted to RGBA once by the caller)."""
+    passthrough = jpeg_passthrough(data, target_long, out_fmt, quality, progressive, optimize,
+                                   convert_to_srgb, keep_metadata, wm_img)
+    if passthrough is not None:
+        return passthrough
+    img = process_one(data, target_long, out_fmt, quality, progressive, optimize,
+                      convert_to_srgb, keep_metadata, wm_img, wm_position, wm_scale_pct,
+                      wm_opacity_pct, wm_margin_px, wm_recolor, wm_cache)
+    return save_image_bytes(img, out_fmt, quality, progressive, optimize, keep_metadata, fast)
+
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def make_output_bytes(data: bytes,
+                      target_long: int,
+                      out_fmt: str,
+                      quality: int,
+                      progressive: bool,
+                      optimize: bool,
+                      convert_to_srgb: bool,
+                      keep_metadata: bool,
+                      wm_bytes: bytes | None,
+                      wm_position: str,
+                      wm_scale_pct: float,
+                      wm_opacity_pct: float,
+                      wm_margin_px: int,
+                      wm_recolor: str = "none",
+                      fast: bool = False) -> bytes:
+    """render_output_bytes, cached on the encoded inputs and settings so reruns
+    that don't change anything skip the whole pipeline."""
+    wm_img = open_watermark(wm_bytes)
+    return render_output_bytes(data, target_long, out_fmt, quality, progressive, optimize,
+                               convert_to_srgb, keep_metadata, wm_img, wm_position, wm_scale_pct,
+                               wm_opacity_pct, wm_margin_px, wm_recolor, fast)
+
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def original_size_estimate(data: bytes) -> int:
+    """Byte size to compare the output against. JPEG/WebP uploads are already lossy,
+    so their own size is used; anything else is measured as a JPEG at quality 95."""
+    if Image.open(io.BytesIO(data)).format in ("JPEG", "WEBP"):
+        return len(data)
+    buf = io.BytesIO()
+    open_image(data).convert("RGB").save(buf, format="JPEG", quality=95)
+    return buf.tell()
+
+
 def filename_with_suffix(name: str, suffix: str, ext: str) -> str:
-    base = (name or "output").replace("\\", "/").split("/")[-1]
-    if "." in base:
-        base = base[:base.rfind(".")]
+    """Output filename for an upload; ext is expected lowercase, without the dot."""
+    base = os.path.basename((name or "output").replace("\\", "/"))
+    # Strip from the last dot, so a bare ".jpg" leaves an empty stem (unlike splitext)
+    stem, dot, _ = base.rpartition(".")
+    if dot:
+        base = stem
     if not base:
         base = "output"
-    return f"{base}{suffix}.{ext.lower()}"
+    return f"{base}{suffix}.{ext}"
 
 def recolor_watermark(wm: Image.Image, mode: str) -> Image.Image:
     """Recolor watermark RGB while preserving alpha.
@@ -247,7 +573,11 @@ with st.sidebar:
 
     out_fmt = st.selectbox("Format", ["JPEG", "WEBP"], index=0)
     quality = st.slider("Quality", min_value=40, max_value=100, value=85, step=1)
-    progressive = st.checkbox("Progressive JPEG", value=True, help="Ignored for WebP")
+    progressive = st.checkbox(
+        "Progressive JPEG",
+        value=True,
+        help="Ignored for WebP, and for images under 800x800 px, where baseline encodes faster at about the same size",
+    )
     optimize = st.checkbox("Optimize", value=True)
 
     st.subheader("Color and metadata")
@@ -269,6 +599,8 @@ with st.sidebar:
     if st.button("Purge session now"):
         for k in list(st.session_state.keys()):
             st.session_state.pop(k, None)
+        make_output_bytes.clear()
+        original_size_estimate.clear()
         # Drop local references commonly used in this script
         try:
             images.clear()
@@ -279,50 +611,59 @@ with st.sidebar:
 
 # Load inputs
 images = read_uploaded_images(uploads)
+ext = out_fmt.lower()
 
-wm_img = None
+wm_bytes = None
 if wm_file is not None:
     try:
-        wm_img = Image.open(wm_file)
+        wm_bytes = wm_file.getvalue()
+        Image.open(io.BytesIO(wm_bytes))
     except Exception:
-        wm_img = None
+        wm_bytes = None
 
 # Preview
 st.subheader("Preview")
 if not images:
     st.info("Upload at least one image or a ZIP to see a preview.")
 else:
-    sample_name, sample_img = images[0]
-    processed_preview = process_one(sample_img, target_long, out_fmt, quality, progressive, optimize,
-                                    convert_to_srgb, keep_metadata, wm_img, wm_position, wm_scale_pct,
-                                    wm_opacity_pct, wm_margin_px, wm_recolor)
-
-    # Compute sizes
+    sample_name, sample_data, _ = images[0]
+    # Uploads are only header-checked, so a corrupt or truncated file fails here
     try:
-        original_bytes = io.BytesIO()
-        sample_img.save(original_bytes, format="JPEG", quality=95)
-        orig_size = len(original_bytes.getvalue())
-    except Exception:
-        orig_size = 0
-
-    out_bytes = save_image_bytes(processed_preview, out_fmt, quality, progressive, optimize, keep_metadata)
-
-    c1, c2 = st.columns(2)
-    with c1:
-        st.caption(f"Original: {sample_name}")
-        st.image(sample_img, width='stretch')
-        if orig_size:
-            st.text(f"Approx original re-encoded size: {orig_size/1024:.1f} KB")
-    with c2:
-        st.caption(f"Preview output: {filename_with_suffix(sample_name, suffix, out_fmt.lower())}")
-        st.image(processed_preview, width='stretch')
-        st.text(f"Estimated output size: {len(out_bytes)/1024:.1f} KB")
-        st.download_button(
-            label="Download preview",
-            data=out_bytes,
-            file_name=filename_with_suffix(sample_name, suffix, out_fmt.lower()),
-            mime="image/jpeg" if out_fmt.upper()=="JPEG" else "image/webp",
-        )
+        out_bytes = make_output_bytes(sample_data, target_long, out_fmt, quality, progressive, optimize,
+                                      convert_to_srgb, keep_metadata, wm_bytes, wm_position, wm_scale_pct,
+                                      wm_opacity_pct, wm_margin_px, wm_recolor, fast=True)
+    except Exception as exc:
+        out_bytes = None
+        st.error(f"Could not process {sample_name}: {exc}")
+
+    if out_bytes is not None:
+        # Compute sizes
+        try:
+            orig_size = original_size_estimate(sample_data)
+        except Exception:
+            orig_size = 0
+
+        c1, c2 = st.columns(2)
+        with c1:
+            st.caption(f"Original: {sample_name}")
+            # Browsers render JPEG/PNG/WebP uploads as-is, so skip decoding and re-encoding them
+            if Image.open(io.BytesIO(sample_data)).format in ("JPEG", "PNG", "WEBP"):
+                st.image(sample_data, width='stretch')
+            else:
+                st.image(open_image(sample_data), width='stretch')
+            if orig_size:
+                st.text(f"Approx original size: {orig_size/1024:.1f} KB")
+        with c2:
+            out_name = filename_with_suffix(sample_name, suffix, ext)
+            st.caption(f"Preview output: {out_name}")
+            st.image(out_bytes, width='stretch')
+            st.text(f"Estimated output size: {len(out_bytes)/1024:.1f} KB")
+            st.download_button(
+                label="Download preview",
+                data=out_bytes,
+                file_name=out_name,
+                mime="image/jpeg" if out_fmt.upper()=="JPEG" else "image/webp",
+            )
 
 st.divider()
 
@@ -332,16 +673,37 @@ if st.button("Process images"):
     if not images:
         st.warning("No images to process.")
     else:
+        wm_img = open_watermark(wm_bytes)
+        wm_cache = {}  # prepared watermark per output width, shared by the workers
+        # Identical uploads (overlapping selections, a ZIP repeating loose files) are rendered once
+        unique = {digest: data for _, data, digest in images}
+        outputs = {}
+        progress = st.progress(0.0, text="Processing images")
+        # Pillow releases the GIL while resizing and encoding, so threads scale across cores
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as ex:
+            futures = {
+                ex.submit(render_output_bytes, data, target_long, out_fmt, quality, progressive, optimize,
+                          convert_to_srgb, keep_metadata, wm_img, wm_position, wm_scale_pct,
+                          wm_opacity_pct, wm_margin_px, wm_recolor, wm_cache=wm_cache): digest
+                for digest, data in unique.items()
+            }
+            for done, fut in enumerate(as_completed(futures), start=1):
+                try:
+                    outputs[futures[fut]] = fut.result()
+                except Exception:
+                    pass  # reported per file below
+                progress.progress(done / len(futures), text=f"Processed {done}/{len(futures)}")
+        progress.empty()
         results: List[Tuple[str, bytes]] = []
-        for name, img in images:
-            out_img = process_one(img, target_long, out_fmt, quality, progressive, optimize,
-                                  convert_to_srgb, keep_metadata, wm_img, wm_position, wm_scale_pct,
-                                  wm_opacity_pct, wm_margin_px, wm_recolor)
-            out_bytes = save_image_bytes(out_img, out_fmt, quality, progressive, optimize, keep_metadata)
-            out_name = filename_with_suffix(name, suffix, out_fmt.lower())
-            results.append((out_name, out_bytes))
-
-        if len(results) == 1:
+        for name, _, digest in images:
+            if digest in outputs:
+                results.append((filename_with_suffix(name, suffix, ext), outputs[digest]))
+            else:
+                st.warning(f"Skipped {name}: the image could not be decoded or processed.")
+
+        if not results:
+            st.warning("No images could be processed.")
+        elif len(results) == 1:
             fname, data = results[0]
             st.download_button(
                 label=f"Download {fname}",
@@ -351,8 +713,13 @@ if st.button("Process images"):
             )
         else:
             # ZIP them
+            # JPEG/WebP payloads are already compressed, deflating them again only burns CPU
+            if out_fmt.upper() in ("JPEG", "WEBP"):
+                compression, compresslevel = zipfile.ZIP_STORED, None
+            else:
+                compression, compresslevel = zipfile.ZIP_DEFLATED, 1
             zip_buf = io.BytesIO()
-            with zipfile.ZipFile(zip_buf, mode="w", compression=zipfile.ZIP_DEFLATED) as zf:
+            with zipfile.ZipFile(zip_buf, mode="w", compression=compression, compresslevel=compresslevel) as zf:
                 for fname, data in results:
                     zf.writestr(fname, data)
             zip_bytes = zip_buf.getvalue()